@@ -1,13 +1,36 @@
 # app.py
 from flask import Flask, render_template, request, jsonify
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
+import functools
+import gzip
+import heapq
 import os
-import json
+import orjson
+import re
+import tempfile
+import threading
 import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime
 import logging
 
+try:
+    # C parser, ~5-10x fromisoformat; also handles +HHMM offsets natively
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:
+    _parse_iso = None
+
+try:
+    # Streaming JSON parser for very large API responses
+    import ijson
+    import ijson.common
+except ImportError:
+    ijson = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,10 +44,106 @@ USERNAME = os.getenv("AUTOTRADER_USERNAME")
 PASSWORD = os.getenv("AUTOTRADER_PASSWORD")
 API_URL = os.getenv("API_URL")
 
+# Shared session so cache-miss fetches reuse TCP/TLS connections instead
+# of re-handshaking per request
+_SESSION = requests.Session()
+_SESSION.auth = (USERNAME, PASSWORD)
+_SESSION.headers.update({
+    "Accept": "application/json",
+    "User-Agent": "AutoTrader-Client-App/1.0"
+})
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+_SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=10))
+
 # Cache settings
-CACHE_FILE = "cache_listings.json"
+CACHE_FILE = "cache_listings.json.gz"
 CACHE_TIMEOUT = 1800  # 30 minutes (in seconds)
 
+# Feeds larger than this are processed in a worker pool; below it the
+# pool spin-up costs more than it saves
+PARALLEL_MIN_ITEMS = 500
+
+# API responses above this size are stream-parsed to avoid holding the
+# raw bytes and the full decoded tree in memory at once; below it the
+# streaming parser's per-event overhead makes it slower than orjson
+STREAM_MIN_BYTES = 1 << 20  # 1 MiB
+
+# Strips everything but digits in a single C-level pass
+_DIGITS_RE = re.compile(r"\D+")
+
+# Turns comma thousand separators into spaces without a substring scan
+_COMMA_TO_SPACE = str.maketrans(",", " ")
+
+# Price strings that mean "price on application"
+_POA_TOKENS = frozenset({"POA", "ON REQUEST", "PRICE ON APPLICATION", ""})
+
+
+@functools.lru_cache(maxsize=8192)
+def _parse_iso_timestamp(dt_str):
+    """
+    Safely parse ISO 8601 datetime string.
+    Returns Unix timestamp for sorting.
+
+    Cached by input string — listing feeds repeat the same 'created'
+    strings across cache hits, so repeats skip the parse entirely.
+    """
+    try:
+        if not dt_str:
+            return 0
+
+        if _parse_iso is not None:
+            return _parse_iso(dt_str).timestamp()
+
+        # Handle different datetime formats
+        if dt_str.endswith('Z'):
+            dt_str = dt_str[:-1] + '+00:00'
+
+        # Fix missing colon in timezone offset (+HHMM -> +HH:MM)
+        tail = dt_str[-5:]
+        if len(tail) == 5 and tail[0] in "+-" and tail[1:].isdigit():
+            dt_str = dt_str[:-2] + ":" + dt_str[-2:]
+
+        dt = datetime.fromisoformat(dt_str)
+        return dt.timestamp()
+    except Exception as e:
+        logger.warning(f"Failed to parse datetime: {dt_str} | Error: {e}")
+        return 0
+
+# In-process memo of the processed, sorted listings for the current cache
+# generation (keyed by the cache file's mtime), so repeat requests within
+# the cache window skip re-processing and re-sorting entirely
+_PROCESSED_CACHE = {"key": None, "listings": None, "by_id": None}
+_PROCESSED_CACHE_LOCK = threading.Lock()
+
+
+def _cache_generation():
+    """Return the cache file's mtime as the current cache generation key"""
+    try:
+        return os.path.getmtime(CACHE_FILE)
+    except OSError:
+        return None
+
+
+@dataclass(slots=True, frozen=True)
+class Listing:
+    """A processed vehicle listing; slots halve per-object memory vs a dict"""
+    id: int
+    make: str
+    model: str
+    year: int
+    price_display: str
+    price: float
+    image_urls: list
+    variant: str
+    body_type: str
+    colour: str
+    location: str
+    mileage: str
+    description: str
+    created: str
+    created_timestamp: float
+    engine: str
+
 
 class VehicleListingProcessor:
     """Handles processing and formatting of vehicle listings"""
@@ -35,62 +154,55 @@ class VehicleListingProcessor:
         Safely parse ISO 8601 datetime string.
         Returns Unix timestamp for sorting.
         """
-        try:
-            if not dt_str:
-                return 0
-            
-            # Handle different datetime formats
-            if dt_str.endswith('Z'):
-                dt_str = dt_str[:-1] + '+00:00'
-            
-            # Fix missing colon in timezone offset
-            if '+' in dt_str and len(dt_str.split('+')[-1]) == 4:
-                parts = dt_str.split('+')
-                dt_str = f"{parts[0]}+{parts[1][:2]}:{parts[1][2:]}"
-            
-            dt = datetime.fromisoformat(dt_str)
-            return dt.timestamp()
-        except Exception as e:
-            logger.warning(f"Failed to parse datetime: {dt_str} | Error: {e}")
-            return 0
+        return _parse_iso_timestamp(dt_str)
+
+    @staticmethod
+    def _format_numeric_price(value):
+        """Format an int/float price (zero still reads as POA)"""
+        if not value:
+            return "POA", 0
+        price_value = float(value)
+        return f"R{price_value:,.0f}".translate(_COMMA_TO_SPACE), price_value
 
     @staticmethod
     def format_price(raw_price_str):
         """Format price string for display and sorting"""
+        # Single type dispatch up front; everything below assumes str
+        t = type(raw_price_str)
+        if t is int or t is float:
+            return VehicleListingProcessor._format_numeric_price(raw_price_str)
+        if t is not str:
+            return "POA", 0
+
+        s = raw_price_str.strip()
+        if s.upper() in _POA_TOKENS:
+            return "POA", 0
+
         price_display = "POA"
         price_value_for_sorting = 0
 
-        if not raw_price_str or (isinstance(raw_price_str, str) and 
-                                raw_price_str.upper() in ["POA", "ON REQUEST", "PRICE ON APPLICATION", ""]):
-            return price_display, price_value_for_sorting
-
         try:
-            if isinstance(raw_price_str, str):
-                raw_price_str = raw_price_str.strip()
-                parts = raw_price_str.split(',')
-                
-                if len(parts) == 2:
-                    major_part_str = parts[0]
-                    minor_part_str = parts[1][:2]
-                    major_digits_only = ''.join(filter(str.isdigit, major_part_str))
-                    
-                    if not major_digits_only:
-                        major_digits_only = "0"
-                    
-                    price_float_str = f"{major_digits_only}.{minor_part_str}"
-                    price_value_for_sorting = float(price_float_str)
-                    major_int = int(major_digits_only)
-                    formatted_major = f"{major_int:,}".replace(',', ' ')
-                    price_display = f"R{formatted_major}"
-                else:
-                    clean_str = ''.join(filter(str.isdigit, raw_price_str))
-                    if clean_str:
-                        price_value_for_sorting = float(clean_str)
-                        price_display = f"R{price_value_for_sorting:,.0f}".replace(',', ' ')
-            elif isinstance(raw_price_str, (int, float)):
-                price_value_for_sorting = float(raw_price_str)
-                price_display = f"R{price_value_for_sorting:,.0f}".replace(',', ' ')
-                
+            parts = s.split(',')
+
+            if len(parts) == 2:
+                major_part_str = parts[0]
+                minor_part_str = parts[1][:2]
+                major_digits_only = _DIGITS_RE.sub('', major_part_str)
+
+                if not major_digits_only:
+                    major_digits_only = "0"
+
+                price_float_str = f"{major_digits_only}.{minor_part_str}"
+                price_value_for_sorting = float(price_float_str)
+                major_int = int(major_digits_only)
+                formatted_major = f"{major_int:,}".translate(_COMMA_TO_SPACE)
+                price_display = f"R{formatted_major}"
+            else:
+                clean_str = _DIGITS_RE.sub('', s)
+                if clean_str:
+                    price_value_for_sorting = float(clean_str)
+                    price_display = f"R{price_value_for_sorting:,.0f}".translate(_COMMA_TO_SPACE)
+
         except (ValueError, IndexError, TypeError) as e:
             logger.warning(f"Error parsing price '{raw_price_str}': {e}")
 
@@ -101,7 +213,7 @@ class VehicleListingProcessor:
         """Format mileage with spaces as thousand separators"""
         try:
             mileage_int = int(mileage) if mileage else 0
-            return f"{mileage_int:,}".replace(',', ' ')
+            return f"{mileage_int:,}".translate(_COMMA_TO_SPACE)
         except (ValueError, TypeError):
             return "0"
 
@@ -124,8 +236,9 @@ class VehicleListingProcessor:
         # Mileage handling
         formatted_mileage = VehicleListingProcessor.format_mileage(item.get("mileageInKm", 0))
 
-        # Images
-        image_urls = item.get("imageUrls", [])
+        # Images — the Unsplash fallback (and its .lower() calls) must stay
+        # inside this branch so listings with photos never pay for it
+        image_urls = item.get("imageUrls")
         if not image_urls:
             image_urls = [f"https://source.unsplash.com/random/800x600/?car,{make.lower()}+{model.lower()}"]
 
@@ -133,24 +246,24 @@ class VehicleListingProcessor:
         created = item.get("created", "")
         created_timestamp = VehicleListingProcessor.parse_iso_datetime(created) if created else time.time()
 
-        return {
-            "id": item.get("id"),
-            "make": make,
-            "model": model,
-            "year": year,
-            "price_display": price_display,
-            "price": price_value_for_sorting,
-            "image_urls": image_urls,
-            "variant": variant,
-            "body_type": body_type,
-            "colour": colour,
-            "location": location,
-            "mileage": formatted_mileage,
-            "description": description,
-            "created": created,
-            "created_timestamp": created_timestamp,
-            "engine": engine
-        }
+        return Listing(
+            id=item.get("id"),
+            make=make,
+            model=model,
+            year=year,
+            price_display=price_display,
+            price=price_value_for_sorting,
+            image_urls=image_urls,
+            variant=variant,
+            body_type=body_type,
+            colour=colour,
+            location=location,
+            mileage=formatted_mileage,
+            description=description,
+            created=created,
+            created_timestamp=created_timestamp,
+            engine=engine
+        )
 
 
 class CacheManager:
@@ -161,14 +274,15 @@ class CacheManager:
         """Read cached data if it exists and is still fresh"""
         if os.path.exists(CACHE_FILE):
             try:
-                with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                    cache = json.load(f)
+                with gzip.open(CACHE_FILE, "rb") as f:
+                    cache = orjson.loads(f.read())
                 if time.time() - cache["timestamp"] < CACHE_TIMEOUT:
                     logger.info("✅ Using cached API data")
                     return cache["data"]
                 else:
                     logger.info("⏳ Cache expired, will fetch fresh data")
-            except (json.JSONDecodeError, KeyError) as e:
+            except (orjson.JSONDecodeError, KeyError, OSError,
+                    EOFError, zlib.error) as e:
                 logger.warning(f"⚠️ Cache file corrupted or invalid: {e}")
         return None
 
@@ -180,8 +294,18 @@ class CacheManager:
                 "timestamp": time.time(),
                 "data": data
             }
-            with open(CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump(cache, f, indent=2, ensure_ascii=False)
+            # Write to a per-writer temp file and swap it in so neither a
+            # crash mid-write nor two workers refreshing concurrently can
+            # leave a corrupt cache behind; level-1 gzip keeps the
+            # compression cost well below the JSON encode itself
+            fd, tmp_file = tempfile.mkstemp(dir=".", prefix=CACHE_FILE + ".")
+            try:
+                with gzip.open(os.fdopen(fd, "wb"), "wb", compresslevel=1) as f:
+                    f.write(orjson.dumps(cache))
+                os.replace(tmp_file, CACHE_FILE)
+            except Exception:
+                os.unlink(tmp_file)
+                raise
             logger.info("💾 Fresh data saved to cache")
         except Exception as e:
             logger.error(f"❌ Failed to save cache: {e}")
@@ -189,25 +313,43 @@ class CacheManager:
 
 class APIClient:
     """Handles API communication"""
-    
+
+    @staticmethod
+    def _stream_listings(stream):
+        """Stream-parse listing objects without building the full JSON tree"""
+        listings = []
+        builder = None
+        item_prefix = None
+        for prefix, event, value in ijson.parse(stream):
+            if builder is not None:
+                builder.event(event, value)
+                if event == "end_map" and prefix == item_prefix:
+                    listings.append(builder.value)
+                    builder = None
+            elif event == "start_map" and prefix in ("item", "listings.item",
+                                                     "vehicles.item"):
+                builder = ijson.common.ObjectBuilder()
+                builder.event(event, value)
+                item_prefix = prefix
+        return listings
+
     @staticmethod
     def fetch_listings_from_api():
         """Fetch vehicle listings from API"""
         logger.info("📡 Fetching fresh data from API...")
         try:
-            response = requests.get(
-                API_URL,
-                auth=(USERNAME, PASSWORD),
-                timeout=10,
-                headers={
-                    "Accept": "application/json",
-                    "User-Agent": "AutoTrader-Client-App/1.0"
-                }
-            )
+            use_stream = ijson is not None
+            response = _SESSION.get(API_URL, timeout=10, stream=use_stream)
 
             if response.status_code == 200:
-                raw_data = response.json()
-                
+                content_length = int(response.headers.get("Content-Length") or 0)
+                if use_stream and content_length > STREAM_MIN_BYTES:
+                    # Large payload: parse items as they arrive
+                    response.raw.decode_content = True
+                    return APIClient._stream_listings(response.raw)
+
+                raw_data = orjson.loads(response.content)
+
                 # Normalize response structure
                 if isinstance(raw_data, list):
                     return raw_data
@@ -224,48 +366,118 @@ class APIClient:
             return None
 
 
-def fetch_listings():
-    """Fetch vehicle listings from API or cache, then sort by 'created' (newest first)"""
-    
-    # Try to get from cache first
+def _get_raw_listings():
+    """Return the raw feed from cache, fetching and caching on a miss"""
     cached_data = CacheManager.get_listings_from_cache()
-    
     if cached_data is not None:
-        raw_listings = cached_data
+        return cached_data
+
+    # Cache miss — fetch from API
+    raw_listings = APIClient.fetch_listings_from_api()
+    if raw_listings is not None:
+        CacheManager.save_listings_to_cache(raw_listings)
+        return raw_listings
+
+    logger.error("❌ No cache available. Showing empty list.")
+    return []
+
+
+def fetch_listings():
+    """Fetch vehicle listings from API or cache, then sort by 'created' (newest first)"""
+
+    # Serve the already-processed list if the cache generation is unchanged
+    key = _cache_generation()
+    with _PROCESSED_CACHE_LOCK:
+        if (key is not None and _PROCESSED_CACHE["key"] == key
+                and time.time() - key < CACHE_TIMEOUT):
+            return _PROCESSED_CACHE["listings"]
+
+    raw_listings = _get_raw_listings()
+
+    # Process each listing — fan out across cores for large feeds
+    if len(raw_listings) > PARALLEL_MIN_ITEMS:
+        with ProcessPoolExecutor() as executor:
+            listings = list(executor.map(VehicleListingProcessor.process_listing,
+                                         raw_listings, chunksize=128))
     else:
-        # Cache miss — fetch from API
-        raw_listings = APIClient.fetch_listings_from_api()
-        
-        if raw_listings is not None:
-            # Save to cache
-            CacheManager.save_listings_to_cache(raw_listings)
-        elif cached_data is not None:
-            # Fallback to stale cache
-            logger.warning("⚠️ Using stale cache due to API failure")
-            raw_listings = cached_data
-        else:
-            logger.error("❌ No cache available. Showing empty list.")
-            raw_listings = []
-
-    # Process each listing
-    listings = [VehicleListingProcessor.process_listing(item) for item in raw_listings]
+        listings = [VehicleListingProcessor.process_listing(item) for item in raw_listings]
     
     # Sort by 'created_timestamp' — newest first
-    listings.sort(key=lambda x: x["created_timestamp"], reverse=True)
-    
+    listings.sort(key=lambda x: x.created_timestamp, reverse=True)
+
+    # Memoize for subsequent requests in this cache generation
+    with _PROCESSED_CACHE_LOCK:
+        _PROCESSED_CACHE["key"] = _cache_generation()
+        _PROCESSED_CACHE["listings"] = listings
+        _PROCESSED_CACHE["by_id"] = {str(l.id): l for l in listings}
+
     logger.info(f"📦 Total processed & sorted listings: {len(listings)}")
     return listings
 
 
+def fetch_featured(k=3):
+    """Fetch only the k newest listings, processing just those items"""
+    # If the full processed list is already memoized, slicing is free
+    key = _cache_generation()
+    with _PROCESSED_CACHE_LOCK:
+        if (key is not None and _PROCESSED_CACHE["key"] == key
+                and time.time() - key < CACHE_TIMEOUT):
+            return _PROCESSED_CACHE["listings"][:k]
+
+    # Cold cache: pick the k newest raw items (O(N log k)) and process
+    # only those, deferring full processing until /inventory needs it.
+    # The key mirrors process_listing: items without 'created' rank as
+    # newest, so both paths feature the same cars
+    raw_listings = _get_raw_listings()
+    top = heapq.nlargest(
+        k, raw_listings,
+        key=lambda it: (_parse_iso_timestamp(it["created"])
+                        if it.get("created") else time.time()))
+    return [VehicleListingProcessor.process_listing(item) for item in top]
+
+
+def fetch_listings_index():
+    """Fetch listings and return the {id: listing} lookup index"""
+    fetch_listings()
+    with _PROCESSED_CACHE_LOCK:
+        return _PROCESSED_CACHE["by_id"] or {}
+
+
+# Rendered-HTML cache for the listing pages, keyed per route on the cache
+# generation, so Jinja runs once per refresh instead of once per request
+_HTML_CACHE = {}
+_HTML_CACHE_LOCK = threading.Lock()
+
+
+def _render_cached(view_name, render):
+    """Return the route's rendered HTML, memoized for the cache window"""
+    key = _cache_generation()
+    if key is not None and time.time() - key < CACHE_TIMEOUT:
+        with _HTML_CACHE_LOCK:
+            entry = _HTML_CACHE.get(view_name)
+            if entry is not None and entry[0] == key:
+                return entry[1]
+
+    html = render()
+
+    # Re-read the generation — rendering may have refreshed the cache
+    key = _cache_generation()
+    if key is not None:
+        with _HTML_CACHE_LOCK:
+            _HTML_CACHE[view_name] = (key, html)
+    return html
+
+
 @app.route("/")
 def home():
     """Home page route"""
     try:
-        # Fetch listings for featured cars section
-        listings = fetch_listings()
-        # Get first 3 listings for featured section
-        featured_listings = listings[:3] if listings else []
-        return render_template("home.html", featured_listings=featured_listings)
+        def render():
+            # Only the featured cars are processed when the memo is cold
+            featured_listings = fetch_featured(3)
+            return render_template("home.html", featured_listings=featured_listings)
+
+        return _render_cached("home", render)
     except Exception as e:
         logger.error(f"Error in home route: {e}")
         # Fallback to empty list if error occurs
@@ -276,8 +488,11 @@ def home():
 def inventory():
     """Inventory page route - shows all listings"""
     try:
-        listings = fetch_listings()
-        return render_template("index.html", listings=listings)
+        def render():
+            listings = fetch_listings()
+            return render_template("index.html", listings=listings)
+
+        return _render_cached("inventory", render)
     except Exception as e:
         logger.error(f"Error in inventory route: {e}")
         return render_template("index.html", listings=[])
@@ -286,20 +501,12 @@ def inventory():
 @app.route("/listing/<int:listing_id>")
 def listing_detail(listing_id):
     try:
-        # First check if we have the listing in our current listings
-        listings = fetch_listings()
-        for listing in listings:
-            if str(listing.get("id")) == str(listing_id):
-                return render_template("listing.html", car=listing)
-        
-        # If not found, try to fetch directly from API
-        raw_listings = APIClient.fetch_listings_from_api()
-        if raw_listings:
-            for item in raw_listings:
-                if str(item.get("id")) == str(listing_id):
-                    processed_listing = VehicleListingProcessor.process_listing(item)
-                    return render_template("listing.html", car=processed_listing)
-                    
+        # The index covers the full feed for this cache generation, so a
+        # miss means the listing doesn't exist — no second API fetch
+        car = fetch_listings_index().get(str(listing_id))
+        if car is not None:
+            return render_template("listing.html", car=car)
+
     except Exception as e:
         logger.error(f"🚨 Error fetching listing {listing_id}: {e}")
     